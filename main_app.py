@@ -1,46 +1,238 @@
+import atexit
 import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache, wraps
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
-from flask import Flask, render_template, request, url_for
+from psycopg2 import pool
+from flask import (Flask, redirect, render_template, request, send_from_directory,
+                   stream_template, url_for)
 import time
-from barcode import EAN13
-from barcode.writer import ImageWriter
 from dotenv import load_dotenv
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 
-ENABLE_CAMERA = os.getenv("ENABLE_CAMERA", "0") == "1"
 BASE_DIR = os.path.dirname(__file__)
 load_dotenv(os.path.join(BASE_DIR, 'my_info.env'))
 
+# læses efter load_dotenv, så de også kan sættes i my_info.env
+ENABLE_CAMERA = os.getenv("ENABLE_CAMERA", "0") == "1"
+PHOTO_MAX_DIM = int(os.getenv("PHOTO_MAX_DIM", "1024"))
+
 # --------------- Database Connection ---------------
 
-def get_db_connection():
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class DatabaseConfigError(RuntimeError):
+    """Database-konfigurationen mangler i miljøet/my_info.env."""
+
+
+def _db_connect_kwargs() -> dict:
+    """
+    Læser database-konfigurationen fra miljøet og returnerer kwargs til psycopg2.connect.
+    """
     db_url = os.getenv("DATABASE_URL")
     if db_url:
-        conn = psycopg2.connect(db_url)
-        return conn
+        return {"dsn": db_url}
 
     host = os.getenv("DATABASE_HOST")
     if not host:
-        raise RuntimeError(
+        raise DatabaseConfigError(
             "Manglende database-konfiguration. Sæt enten DATABASE_URL "
             "eller DATABASE_HOST/DATABASE_PORT/DATABASE_NAME/DATABASE_USER/DATABASE_PASSWORD i my_info.env."
         )
 
-    conn = psycopg2.connect(
-        host=host,
-        port=os.getenv("DATABASE_PORT"),
-        dbname=os.getenv("DATABASE_NAME"),
-        user=os.getenv("DATABASE_USER"),
-        password=os.getenv("DATABASE_PASSWORD"),
-        sslmode=os.getenv("DB_SSLMODE", "require"),
-    )
-    return conn
+    return {
+        "host": host,
+        "port": os.getenv("DATABASE_PORT"),
+        "dbname": os.getenv("DATABASE_NAME"),
+        "user": os.getenv("DATABASE_USER"),
+        "password": os.getenv("DATABASE_PASSWORD"),
+        "sslmode": os.getenv("DB_SSLMODE", "require"),
+    }
+
+
+# Hyppige queries forberedes én gang pr. fysisk forbindelse (PREPARE/EXECUTE),
+# så serveren ikke skal parse og planlægge dem ved hver request.
+_PREPARED_STATEMENTS = {
+    "stmt_detail": """
+        SELECT product_id, product_ean, product_name, product_desc, product_image, stock_qty, tags
+        FROM produkter
+        WHERE product_id = %s
+        LIMIT 1
+    """,
+    "stmt_qty_add": """
+        UPDATE produkter SET stock_qty = stock_qty + %s WHERE product_id = %s
+    """,
+    "stmt_scan_upsert": """
+        INSERT INTO produkter (product_ean, product_name, stock_qty)
+        VALUES (%s, '', GREATEST(%s, 0))
+        ON CONFLICT (product_ean) DO UPDATE
+        SET stock_qty = produkter.stock_qty + %s
+        RETURNING product_id,
+                  (xmax = 0) OR COALESCE(produkter.product_name, '') = '' AS needs_details
+    """,
+}
+
+
+def _to_server_params(sql: str) -> str:
+    """'... = %s AND ... = %s' -> '... = $1 AND ... = $2' til PREPARE."""
+    counter = iter(range(1, sql.count('%s') + 1))
+    return re.sub(r'%s', lambda _: f"${next(counter)}", sql)
+
+
+class _PreparedConnection(psycopg2.extensions.connection):
+    """
+    Forbindelse, der forsøger PREPARE for hver af _PREPARED_STATEMENTS, når den oprettes.
+    En statement, der ikke kan forberedes, logges og køres i stedet som almindelig SQL
+    (se _execute), så én fejl ikke forhindrer at forbindelsen kan bruges.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        # autocommit, så en fejlet PREPARE ikke afbryder de efterfølgende
+        self.autocommit = True
+        with self.cursor() as cur:
+            for name, sql in _PREPARED_STATEMENTS.items():
+                try:
+                    cur.execute(f"PREPARE {name} AS {_to_server_params(sql)}")
+                    self.prepared.add(name)
+                except psycopg2.Error as e:
+                    print(f"Fejl: kunne ikke forberede {name}, bruger almindelig SQL: {e}")
+        self.autocommit = False
+
+
+def _execute(cur, name: str, params: tuple) -> None:
+    """
+    Kører en af _PREPARED_STATEMENTS: EXECUTE hvis den er forberedt på forbindelsen,
+    ellers den almindelige SQL.
+    """
+    if name in getattr(cur.connection, 'prepared', ()):
+        placeholders = ", ".join(["%s"] * len(params))
+        cur.execute(f"EXECUTE {name}({placeholders})", params)
+    else:
+        cur.execute(_PREPARED_STATEMENTS[name], params)
+
+
+def _get_pool():
+    """
+    Opretter connection-poolen første gang den skal bruges (én pr. proces/worker).
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # poolen beholder højst minconn ledige forbindelser og lukker resten ved putconn,
+                # så minconn skal mindst svare til antal tråde pr. worker (--threads 4 i Procfile)
+                minconn = int(os.getenv("DB_POOL_MIN", "4"))
+                maxconn = max(minconn, int(os.getenv("DB_POOL_MAX", "10")))
+                _pool = pool.ThreadedConnectionPool(
+                    minconn=minconn,
+                    maxconn=maxconn,
+                    connection_factory=_PreparedConnection,
+                    **_db_connect_kwargs(),
+                )
+                atexit.register(_pool.closeall)
+    return _pool
+
+
+@contextmanager
+def db_conn(autocommit: bool = False):
+    """
+    Låner en forbindelse fra poolen og lægger den tilbage bagefter.
+    Åbne transaktioner rulles tilbage af poolen ved putconn.
+    autocommit=True er til enkelt-statements: ingen BEGIN/COMMIT og intet conn.commit().
+    """
+    p = _get_pool()
+    conn = p.getconn()
+    try:
+        if autocommit:
+            conn.autocommit = True
+        yield conn
+    finally:
+        if autocommit and not conn.closed:
+            conn.autocommit = False
+        p.putconn(conn)
+
+
+def with_db(view=None, *, autocommit: bool = False):
+    """
+    Decorator til views: låner en forbindelse fra poolen og giver den som første argument.
+    Ved databasefejl rulles der tilbage, og detaljesiden vises med fejlen
+    (også når database-konfigurationen mangler).
+    Brug @with_db eller @with_db(autocommit=True).
+    """
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                with db_conn(autocommit=autocommit) as conn:
+                    try:
+                        return view(conn, *args, **kwargs)
+                    except psycopg2.Error:
+                        if not conn.closed:
+                            conn.rollback()
+                        raise
+            except (psycopg2.Error, DatabaseConfigError) as e:
+                product = {'product_id': kwargs['product_id']} if 'product_id' in kwargs else None
+                return render_template('product_detail.html',
+                                       error=f"Databasefejl: {e}", product=product)
+        return wrapper
+
+    if view is not None:
+        return decorate(view)
+    return decorate
+
+
+@app.cli.command('init-db')
+def init_db():
+    """
+    Sikrer et unikt indeks på produkter.product_ean (kør én gang: flask --app main_app init-db).
+    Opretter kun produkter_ean_uk, hvis der ikke allerede findes et unikt indeks/constraint på kolonnen.
+    """
+    # almindelig forbindelse uden poolens PREPARE-opsætning
+    conn = psycopg2.connect(**_db_connect_kwargs())
+    with conn, conn.cursor() as cur:
+        # ON CONFLICT (product_ean) i products_create kræver allerede et unikt indeks,
+        # så normalt findes det – et ekstra ville bare skulle vedligeholdes ved hver skrivning
+        cur.execute("""
+            SELECT i.indexrelid::regclass::text
+            FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+            WHERE i.indrelid = 'produkter'::regclass
+              AND i.indisunique
+              AND i.indnatts = 1
+              AND i.indpred IS NULL
+              AND a.attname = 'product_ean'
+            LIMIT 1
+        """)
+        existing = cur.fetchone()
+        if existing is None:
+            cur.execute("CREATE UNIQUE INDEX produkter_ean_uk ON produkter (product_ean)")
+    conn.close()
+    if existing is None:
+        print("Unikt indeks produkter_ean_uk er oprettet.")
+    else:
+        print(f"Unikt indeks på product_ean findes allerede ({existing[0]}).")
 
 
 # --------------- Barcode helpers ---------------
 
+_NON_DIGIT_RE = re.compile(r'\D')
+
+
+def _digits(s: str) -> str:
+    """'5701-234 567.890' -> '5701234567890'"""
+    return _NON_DIGIT_RE.sub('', s)
+
+
 def parse_tags(raw: str | None) -> list[str] | None:
     """
     'sodavand, 1.5L, Cola' -> ['sodavand','1.5l','cola']
@@ -48,97 +240,323 @@ def parse_tags(raw: str | None) -> list[str] | None:
     """
     if raw is None:
         return None
-    tags = [t.strip().lower() for t in raw.split(',') if t.strip()]
-    # fjern dubletter men bevar rækkefølge
-    return list(dict.fromkeys(tags))
+    # strip/filter kører i C via map/filter; dict.fromkeys fjerner dubletter men bevarer rækkefølge
+    return list(dict.fromkeys(filter(None, map(str.strip, raw.lower().split(',')))))
 
 
-def read_barcode_from_camera():
-    if not ENABLE_CAMERA:
-        raise RuntimeError("Camera is disabled in this environment")
+_cv2_mod = None
 
-    import cv2
-    from zxingcpp import read_barcodes
+
+def _cv2():
+    """
+    Importerer OpenCV første gang kameraet bruges, så headless servere aldrig loader det.
+    """
+    global _cv2_mod
+    if _cv2_mod is None:
+        import cv2
+        _cv2_mod = cv2
+    return _cv2_mod
+
+
+class LatestFrameCapture:
+    """
+    Læser fra kameraet i en baggrundstråd og gemmer kun den nyeste ramme,
+    så dekodning/visning i hovedtråden aldrig arbejder på en gammel kø af rammer.
+    Har samme read()/isOpened()/release() som cv2.VideoCapture.
+    """
+
+    def __init__(self, src, width: int | None = None, height: int | None = None):
+        cv2 = _cv2()
+
+        self.cap = cv2.VideoCapture(src)
+        if width:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0       # tæller for nye rammer
+        self._read_seq = 0  # sidste ramme leveret af read()
+        self._stop = False
+        self._thread = None
+        self._opened = self.cap.isOpened()
+        if self._opened:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        # kun denne tråd rører self.cap, så release() kan ikke ramme midt i et read()
+        try:
+            while not self._stop:
+                ok, frame = self.cap.read()
+                with self._cond:
+                    if not ok:
+                        self._stop = True
+                    else:
+                        self._frame = frame
+                        self._seq += 1
+                    self._cond.notify_all()
+        finally:
+            self.cap.release()
+
+    def isOpened(self) -> bool:
+        return self._opened
+
+    def read(self, timeout: float = 2.0):
+        """
+        Returnerer (True, ramme) for den nyeste ramme, som ikke allerede er leveret.
+        Venter højst timeout sekunder; (False, None) hvis kameraet er stoppet.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._stop or self._seq != self._read_seq, timeout)
+            if self._frame is None or self._seq == self._read_seq:
+                return False, None
+            self._read_seq = self._seq
+            return True, self._frame.copy()
+
+    def release(self):
+        with self._cond:
+            self._stop = True
+        if self._thread is not None:
+            # læsetråden frigiver selv kameraet, når den ser _stop
+            self._thread.join()
+        else:
+            self.cap.release()
+
+
+def read_barcode_from_camera(camera_adr: int = 0, preview: bool = True):
     """
     Scanner én stregkode via webcam og returnerer teksten (EAN) som str.
     Lukker kamera og vinduer, når en kode er fundet eller 'q' trykkes.
+    Med preview=False vises intet vindue (og der ventes ikke på tastatur).
     """
-    camera = cv2.VideoCapture(camera_adr)
+    if not ENABLE_CAMERA:
+        return None
+
+    cv2 = _cv2()
+    from zxingcpp import read_barcodes
+
+    # rammer hentes i egen tråd; read() giver altid den nyeste
+    camera = LatestFrameCapture(camera_adr, width=640, height=480)
     if not camera.isOpened():
         print("Fejl: Kunne ikke åbne kamera.")
+        camera.release()
         return None
 
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
     time.sleep(1)
 
+    decode_every = 3       # dekod kun hver 3. ramme
+    full_frame_after = 10  # antal forgæves ROI-forsøg før vi dekoder hele rammen
+
     found_text = None
+    i = 0
+    misses = 0
     while True:
         ret, frame = camera.read()
         if not ret:
             print("Fejl: Kunne ikke læse en ramme.")
             break
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        barcodes = read_barcodes(gray)
+        i += 1
+        barcodes = None
+        if i % decode_every == 0:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if misses < full_frame_after:
+                # midterste del af billedet i halv opløsning (EAN holdes typisk centreret)
+                h, w = gray.shape
+                off_x, off_y, scale = w // 4, h // 4, 2
+                roi = gray[h // 4:3 * h // 4, w // 4:3 * w // 4]
+                small = cv2.resize(roi, (roi.shape[1] // 2, roi.shape[0] // 2),
+                                   interpolation=cv2.INTER_AREA)
+                barcodes = read_barcodes(small)
+            else:
+                off_x, off_y, scale = 0, 0, 1
+                barcodes = read_barcodes(gray)
+            if not barcodes:
+                misses += 1
 
         if barcodes:
             # Tag første fund
             bc = barcodes[0]
             found_text = str(bc.text).strip()
             # Vis en ramme med grøn boks (valgfrit)
-            try:
-                p1 = (int(bc.position.top_left.x), int(bc.position.top_left.y))
-                p2 = (int(bc.position.top_right.x), int(bc.position.top_right.y))
-                p3 = (int(bc.position.bottom_right.x), int(bc.position.bottom_right.y))
-                p4 = (int(bc.position.bottom_left.x), int(bc.position.bottom_left.y))
-                cv2.line(frame, p1, p2, (0, 255, 0), 2)
-                cv2.line(frame, p2, p3, (0, 255, 0), 2)
-                cv2.line(frame, p3, p4, (0, 255, 0), 2)
-                cv2.line(frame, p4, p1, (0, 255, 0), 2)
-                cv2.imshow("Barcode Scanner", frame)
-                cv2.waitKey(500)  # kort visning
-            except Exception:
-                pass
+            if preview:
+                try:
+                    def to_frame(p):
+                        return (int(p.x) * scale + off_x, int(p.y) * scale + off_y)
+                    p1 = to_frame(bc.position.top_left)
+                    p2 = to_frame(bc.position.top_right)
+                    p3 = to_frame(bc.position.bottom_right)
+                    p4 = to_frame(bc.position.bottom_left)
+                    cv2.line(frame, p1, p2, (0, 255, 0), 2)
+                    cv2.line(frame, p2, p3, (0, 255, 0), 2)
+                    cv2.line(frame, p3, p4, (0, 255, 0), 2)
+                    cv2.line(frame, p4, p1, (0, 255, 0), 2)
+                    cv2.imshow("Barcode Scanner", frame)
+                    cv2.waitKey(500)  # kort visning
+                except Exception:
+                    pass
             break
 
-        cv2.imshow("Barcode Scanner", frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+        if preview:
+            cv2.imshow("Barcode Scanner", frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
 
     camera.release()
-    try:
-        cv2.destroyAllWindows()
-    except Exception:
-        pass
+    if preview:
+        try:
+            cv2.destroyAllWindows()
+        except Exception:
+            pass
     return found_text
 
 
-def save_barcode_simple(ean_number: str) -> str | None:
+_barcode_cache: set[str] | None = None
+_barcode_lock = threading.Lock()
+
+
+def _barcode_set() -> set[str]:
     """
-    Gemmer 'barcode {EAN}.png' i static/barcodes hvis ikke den findes.
-    Returnerer relativ sti (fx 'barcodes/barcode 5701234567890.png') eller None.
+    Sæt af filnavne i static/barcodes, som vi ved findes. Læses én gang fra disk
+    og udvides derefter af _render_barcode og _barcode_exists.
     """
-    clean = str(ean_number).strip().replace(".", "")
-    clean = "".join(ch for ch in clean if ch.isdigit())
-    if len(clean) < 12:
-        return None  # for kort til EAN13
+    global _barcode_cache
+    if _barcode_cache is None:
+        with _barcode_lock:
+            if _barcode_cache is None:
+                barcode_dir = os.path.join(app.static_folder, 'barcodes')
+                try:
+                    _barcode_cache = set(os.listdir(barcode_dir))
+                except FileNotFoundError:
+                    _barcode_cache = set()
+    return _barcode_cache
+
+
+def _barcode_exists(fname: str) -> bool:
+    """
+    Findes static/barcodes/{fname}? Kun fund caches: ved en miss tjekkes disken,
+    da filen kan være skrevet af en anden worker eller lagt ind efter opstart.
+    """
+    known = _barcode_set()
+    if fname in known:
+        return True
+    if os.path.exists(os.path.join(app.static_folder, 'barcodes', fname)):
+        known.add(fname)
+        return True
+    return False
+
+
+# EAN13-kodetabeller (L/G/R) og paritet for venstre halvdel ud fra første ciffer
+_EAN_L = ("0001101", "0011001", "0010011", "0111101", "0100011",
+          "0110001", "0101111", "0111011", "0110111", "0001011")
+_EAN_G = tuple(code.translate(str.maketrans("01", "10"))[::-1] for code in _EAN_L)
+_EAN_R = tuple(code.translate(str.maketrans("01", "10")) for code in _EAN_L)
+_EAN_PARITY = ("LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+               "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL")
 
+
+def _ean13_checksum(clean12: str) -> str:
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(clean12))
+    return str((10 - total % 10) % 10)
+
+
+def fast_ean13(clean12: str, path: str, module_w: int = 3, bar_h: int = 150, quiet: int = 11) -> None:
+    """
+    Tegner en EAN13-stregkode for 12 cifre (checksum beregnes) og gemmer som PNG.
+    Stregerne laves som ét NumPy-array i stedet for python-barcodes tegneløkke.
+    """
+    import numpy as np
+    from PIL import Image, ImageDraw, ImageFont
+
+    digits = clean12 + _ean13_checksum(clean12)
+    parity = _EAN_PARITY[int(digits[0])]
+    left = "".join((_EAN_L if p == "L" else _EAN_G)[int(d)] for p, d in zip(parity, digits[1:7]))
+    right = "".join(_EAN_R[int(d)] for d in digits[7:])
+    pattern = "101" + left + "01010" + right + "101"  # 95 moduler
+    bits = np.frombuffer(pattern.encode(), np.uint8) == ord("1")
+
+    # start-, midter- og slutmarkeringer er længere end de øvrige streger
+    guard = np.zeros(95, bool)
+    guard[[0, 1, 2, 45, 46, 47, 48, 49, 92, 93, 94]] = True
+
+    text_h = 10 * module_w
+    top = 2 * module_w
+    x0 = quiet * module_w
+    x1 = x0 + 95 * module_w
+    img = np.full((top + bar_h + text_h, x1 + quiet * module_w), 255, np.uint8)
+
+    cols = np.repeat(bits, module_w)
+    img[top:top + bar_h, x0:x1][:, cols] = 0
+    img[top + bar_h:top + bar_h + text_h // 2, x0:x1][:, cols & np.repeat(guard, module_w)] = 0
+
+    im = Image.fromarray(img)
+    draw = ImageDraw.Draw(im)
+    font = ImageFont.load_default(size=text_h - 2 * module_w)
+    ty = top + bar_h + module_w
+    draw.text((x0 - 7 * module_w, ty), digits[0], fill=0, font=font)
+    draw.text((x0 + 5 * module_w, ty), digits[1:7], fill=0, font=font)
+    draw.text((x0 + 51 * module_w, ty), digits[7:], fill=0, font=font)
+    im.save(path, compress_level=1)
+
+
+@lru_cache(maxsize=4096)
+def _render_barcode(clean: str) -> str:
+    """
+    Renderer 'barcode {EAN}.png' med fast_ean13 og returnerer relativ sti.
+    clean skal være mindst 12 cifre; memoiseret så samme EAN kun tegnes én gang.
+    """
     out_dir = os.path.join(app.static_folder, "barcodes")
     os.makedirs(out_dir, exist_ok=True)
 
     base = f"barcode {clean}"
-    png_path = os.path.join(out_dir, base + ".png")
+    # EAN13 tegnes ud fra 12 cifre (checksum beregnes)
+    fast_ean13(clean[:12], os.path.join(out_dir, base + ".png"))
+    _barcode_set().add(base + ".png")
+    return f"barcodes/{base}.png"
+
+
+def _clean_ean(ean_number: str) -> str | None:
+    clean = _digits(str(ean_number))
+    if len(clean) < 12:
+        return None  # for kort til EAN13
+    return clean
+
 
-    if os.path.exists(png_path):
-        # findes allerede – spring over (som i dit eksempel)
-        print(f"{base} findes allerede – springer over")
+def save_barcode_simple(ean_number: str) -> str | None:
+    """
+    Gemmer 'barcode {EAN}.png' i static/barcodes hvis ikke den findes.
+    Returnerer relativ sti (fx 'barcodes/barcode 5701234567890.png') eller None.
+    """
+    clean = _clean_ean(ean_number)
+    if clean is None:
+        return None
+
+    base = f"barcode {clean}"
+    if _barcode_exists(base + ".png"):
         return f"barcodes/{base}.png"
 
-    # python-barcode EAN13 vil have 12 cifre (uden checksum)
-    data12 = clean[:12]
-    EAN13(data12, writer=ImageWriter()).save(os.path.join(out_dir, base))
-    return f"barcodes/{base}.png"
+    return _render_barcode(clean)
+
+
+_barcode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="barcode")
+
+
+def _report_render_error(fut):
+    exc = fut.exception()
+    if exc is not None:
+        print(f"Fejl: kunne ikke generere stregkode: {exc}")
+
+
+def save_barcode_background(ean_number: str) -> None:
+    """
+    Kører save_barcode_simple i en baggrundstråd, så scan-routes ikke venter på
+    tegningen. Billedet serveres bagefter som statisk fil.
+    """
+    _barcode_executor.submit(save_barcode_simple, ean_number).add_done_callback(_report_render_error)
+
 
 def ensure_dirs():
     os.makedirs(os.path.join(app.static_folder, 'barcodes'), exist_ok=True)
@@ -146,29 +564,69 @@ def ensure_dirs():
 
 # --- Interaktiv foto-capture via OpenCV (med klikbar "Tag foto"-knap) ---
 
-_capture_click = {"pressed": False}
+_overlay_cache: dict = {}
 
-def _mouse_cb(event, x, y, flags, param):
+
+def _photo_overlay(h: int, w: int, btn_w: int, btn_h: int, margin: int):
     """
-    Mouse callback for at registrere klik på 'Tag foto'-knappen.
-    param forventes at være en dict med 'btn_rect': (x1,y1,x2,y2).
+    Bygger knap + tekst til foto-vinduet én gang pr. opløsning.
+    Returnerer (btn_rect, tekstlag, maske); tekstlaget er sort undtagen hvor der er tegnet.
     """
-    if event == cv2.EVENT_LBUTTONDOWN and param and "btn_rect" in param:
-        x1, y1, x2, y2 = param["btn_rect"]
-        if x1 <= x <= x2 and y1 <= y <= y2:
-            _capture_click["pressed"] = True
-
-def capture_photo_interactive_to_static(basename: str, camera_adr: int = 0) -> str | None:
+    key = (h, w, btn_w, btn_h, margin)
+    cached = _overlay_cache.get(key)
+    if cached is not None:
+        return cached
+
+    cv2 = _cv2()
+    import numpy as np
+
+    # Knap-position i bunden til højre
+    x2 = w - margin
+    y2 = h - margin
+    x1 = x2 - btn_w
+    y1 = y2 - btn_h
+
+    sprite = np.zeros((h, w, 3), np.uint8)
+
+    # Kant + tekst
+    cv2.rectangle(sprite, (x1, y1), (x2, y2), (230, 230, 230), 2)
+    label = "Tag foto"
+    (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)
+    tx = x1 + (btn_w - tw) // 2
+    ty = y1 + (btn_h + th) // 2 - 4
+    # uden LINE_AA: kantpixels blandet mod sort baggrund ville give en mørk kant, når spriten kopieres ind
+    cv2.putText(sprite, label, (tx, ty), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (20, 20, 20), 2, cv2.LINE_8)
+
+    # Instruktioner
+    cv2.putText(sprite, "SPACE/ENTER: tag foto  |  q: annuller",
+                (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (240, 240, 240), 2, cv2.LINE_8)
+
+    mask = (sprite != 0).any(axis=2)[..., None]
+    cached = ((x1, y1, x2, y2), sprite, mask)
+    _overlay_cache[key] = cached
+    return cached
+
+
+def capture_photo_interactive_to_static(basename: str, camera_adr: int = 0,
+                                        hires: bool = False) -> str | None:
     """
     Viser live kamerabillede i et vindue med en klikbar 'Tag foto'-knap.
     SPACE/ENTER tager også foto. 'q' annullerer.
-    Gemmer som JPG i static/product_img/{basename}.jpg
+    Gemmer som JPG i static/product_img/{basename}.jpg, nedskaleret til højst
+    PHOTO_MAX_DIM pixels (hires=True gemmer originalen uændret).
     Returnerer relativ sti 'product_img/xxx.jpg' eller None.
     """
+    if not ENABLE_CAMERA:
+        return None
+
+    cv2 = _cv2()
+    import numpy as np
+
     ensure_dirs()
-    cap = cv2.VideoCapture(camera_adr)
+    cap = LatestFrameCapture(camera_adr)
     if not cap.isOpened():
         print("Fejl: kunne ikke åbne kamera.")
+        cap.release()
         return None
 
     # (valgfrit) lidt opstartsdelay
@@ -182,8 +640,18 @@ def capture_photo_interactive_to_static(basename: str, camera_adr: int = 0) -> s
     margin = 20
 
     # mouse-callback state
-    state = {"btn_rect": (0, 0, 0, 0)}
-    cv2.setMouseCallback(window_name, _mouse_cb, state)
+    state = {"btn_rect": (0, 0, 0, 0), "pressed": False}
+
+    def on_mouse(event, x, y, flags, param):
+        """
+        Registrerer klik på 'Tag foto'-knappen (param er state-dict'en).
+        """
+        if event == cv2.EVENT_LBUTTONDOWN:
+            x1, y1, x2, y2 = param["btn_rect"]
+            if x1 <= x <= x2 and y1 <= y <= y2:
+                param["pressed"] = True
+
+    cv2.setMouseCallback(window_name, on_mouse, state)
 
     captured = None
     while True:
@@ -192,31 +660,18 @@ def capture_photo_interactive_to_static(basename: str, camera_adr: int = 0) -> s
             print("Fejl: kunne ikke læse fra kamera.")
             break
 
-        # Beregn knap-position i bunden til højre
+        # Knap + tekst er forudtegnet pr. opløsning
         h, w = frame.shape[:2]
-        x2 = w - margin
-        y2 = h - margin
-        x1 = x2 - btn_w
-        y1 = y2 - btn_h
+        (x1, y1, x2, y2), sprite, mask = _photo_overlay(h, w, btn_w, btn_h, margin)
         state["btn_rect"] = (x1, y1, x2, y2)
 
-        # Tegn semitransparent knap
-        overlay = frame.copy()
-        cv2.rectangle(overlay, (x1, y1), (x2, y2), (255, 255, 255), -1)
+        # Semitransparent hvid knap – kun knappens område blandes
         alpha = 0.35
-        frame = cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0)
+        roi = frame[y1:y2 + 1, x1:x2 + 1]
+        cv2.addWeighted(roi, 1 - alpha, roi, 0, 255 * alpha, dst=roi)
 
         # Kant + tekst
-        cv2.rectangle(frame, (x1, y1), (x2, y2), (230, 230, 230), 2)
-        label = "Tag foto"
-        (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)
-        tx = x1 + (btn_w - tw) // 2
-        ty = y1 + (btn_h + th) // 2 - 4
-        cv2.putText(frame, label, (tx, ty), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (20, 20, 20), 2, cv2.LINE_AA)
-
-        # Instruktioner
-        cv2.putText(frame, "SPACE/ENTER: tag foto  |  q: annuller",
-                    (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (240, 240, 240), 2, cv2.LINE_AA)
+        np.copyto(frame, sprite, where=mask)
 
         cv2.imshow(window_name, frame)
 
@@ -227,9 +682,8 @@ def capture_photo_interactive_to_static(basename: str, camera_adr: int = 0) -> s
         if key == ord('q'):
             captured = None
             break
-        if _capture_click["pressed"]:
+        if state["pressed"]:
             captured = frame.copy()
-            _capture_click["pressed"] = False
             break
 
     cap.release()
@@ -244,8 +698,17 @@ def capture_photo_interactive_to_static(basename: str, camera_adr: int = 0) -> s
     rel_path = f"product_img/{basename}.jpg"
     abs_path = os.path.join(app.static_folder, rel_path)
 
-    # Gem som JPG (kan evt. nedskalere/komprimere her hvis ønsket)
-    ok = cv2.imwrite(abs_path, captured)
+    # Nedskaler til PHOTO_MAX_DIM og gem som komprimeret JPG (medmindre hires)
+    params = []
+    if not hires:
+        h, w = captured.shape[:2]
+        s = min(1.0, PHOTO_MAX_DIM / max(h, w))
+        if s < 1:
+            captured = cv2.resize(captured, (int(w * s), int(h * s)), interpolation=cv2.INTER_AREA)
+        params = [cv2.IMWRITE_JPEG_QUALITY, 85,
+                  cv2.IMWRITE_JPEG_OPTIMIZE, 1,
+                  cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+    ok = cv2.imwrite(abs_path, captured, params)
     if not ok:
         print("Fejl: kunne ikke gemme produktfoto.")
         return None
@@ -254,6 +717,40 @@ def capture_photo_interactive_to_static(basename: str, camera_adr: int = 0) -> s
 
 
 
+# --------------- Media (stregkoder og produktfotos) ---------------
+@app.route('/barcodes/<path:fname>')
+def barcode(fname):
+    """
+    Stregkoder navngives efter EAN og ændrer sig aldrig – må caches "for evigt".
+    """
+    resp = send_from_directory(os.path.join(app.static_folder, 'barcodes'), fname, max_age=31536000)
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
+
+
+@app.route('/product_img/<path:fname>')
+def product_img(fname):
+    """
+    Produktfotos overskrives med samme filnavn, når der tages nyt foto,
+    så de må caches, men skal genvalideres (ETag/Last-Modified -> 304).
+    """
+    resp = send_from_directory(os.path.join(app.static_folder, 'product_img'), fname, max_age=0)
+    resp.headers['Cache-Control'] = 'public, no-cache'
+    return resp
+
+
+@app.template_global()
+def product_image_url(rel: str) -> str:
+    """
+    URL til en gemt product_image-sti (relativ til static). Fotos under product_img/
+    går via product_img-routen; andre stier serveres som almindelige static-filer.
+    """
+    prefix = 'product_img/'
+    if rel.startswith(prefix):
+        return url_for('product_img', fname=rel[len(prefix):])
+    return url_for('static', filename=rel)
+
+
 # --------------- Home / Welcome Page ---------------
 @app.route('/')
 def index():
@@ -281,40 +778,30 @@ def search():
         try:
             if product_id.isdigit():
                 # Slå op på ID
-                conn = get_db_connection()
-                cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                cur.execute("""
-                    SELECT product_id, product_ean, product_name, product_desc,
-                           product_image, stock_qty, tags
-                    FROM produkter
-                    WHERE product_id = %s
-                """, (int(product_id),))
-                product = cur.fetchone()
-                cur.close(); conn.close()
+                with db_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    _execute(cur, "stmt_detail", (int(product_id),))
+                    product = cur.fetchone()
 
                 # Lokal stregkode: PNG først, SVG fallback
                 if product and product.get('product_ean'):
-                    ean = ''.join(ch for ch in str(product['product_ean']) if ch.isdigit())
-                    barcode_dir = os.path.join(app.static_folder, 'barcodes')
+                    ean = _digits(str(product['product_ean']))
                     for fname in (f"barcode {ean}.png", f"barcode {ean}.svg"):
-                        if os.path.exists(os.path.join(barcode_dir, fname)):
-                            image_url = url_for('static', filename=f'barcodes/{fname}')
+                        if _barcode_exists(fname):
+                            image_url = url_for('barcode', fname=fname)
                             break
 
             elif tags_q:
                 # Søgning på tags (mindst ét overlap)
-                terms = [t.strip().lower() for t in tags_q.split(',') if t.strip()]
+                terms = parse_tags(tags_q) or []
                 if terms:
-                    conn = get_db_connection()
-                    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                    cur.execute("""
-                        SELECT product_id, product_ean, product_name, product_desc, stock_qty
-                        FROM produkter
-                        WHERE tags && %s::text[]
-                        ORDER BY product_id
-                    """, (terms,))
-                    rows = cur.fetchall()
-                    cur.close(); conn.close()
+                    with db_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor) as cur:
+                        cur.execute("""
+                            SELECT product_id, product_ean, product_name, product_desc, stock_qty
+                            FROM produkter
+                            WHERE tags && %s::text[]
+                            ORDER BY product_id
+                        """, (terms,))
+                        rows = cur.fetchall()
                     # Vis liste-skabelonen ved tag-søgning
                     return render_template('products.html', rows=rows, error=None)
                 else:
@@ -333,32 +820,23 @@ def search():
 # --------------- Products: List / Create / Read / Update / Delete ---------------
 
 @app.route('/products/<int:product_id>/qty/add', methods=['POST'])
-def products_qty_add(product_id):
-    from flask import request, url_for, render_template
+@with_db(autocommit=True)
+def products_qty_add(conn, product_id):
     try:
         delta = int(request.form.get('delta', 1))
     except ValueError:
         delta = 0
 
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("UPDATE produkter SET stock_qty = stock_qty + %s WHERE product_id = %s",
-                    (delta, product_id))
-        conn.commit()
-        cur.close()
-        conn.close()
-    except Exception as e:
-        return render_template('product_detail.html',
-                               error=f'DB-fejl: {e}', product={'product_id': product_id})
+    with conn.cursor() as cur:
+        _execute(cur, "stmt_qty_add", (delta, product_id))
 
-    return render_template('redirect.html', target=url_for('products_detail', product_id=product_id))
+    return redirect(url_for('products_detail', product_id=product_id), code=303)
 
 
 # sæt antal direkte
 @app.route('/products/<int:product_id>/qty/set', methods=['POST'])
-def products_qty_set(product_id):
-    from flask import request, url_for, render_template
+@with_db(autocommit=True)
+def products_qty_set(conn, product_id):
     try:
         new_qty = int(request.form.get('qty', 0))
         if new_qty < 0:
@@ -366,27 +844,21 @@ def products_qty_set(product_id):
     except ValueError:
         new_qty = 0
 
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+    with conn.cursor() as cur:
         cur.execute("UPDATE produkter SET stock_qty = %s WHERE product_id = %s",
                     (new_qty, product_id))
-        conn.commit()
-        cur.close()
-        conn.close()
-    except Exception as e:
-        return render_template('product_detail.html',
-                               error=f'DB-fejl: {e}', product={'product_id': product_id})
 
-    return render_template('redirect.html', target=url_for('products_detail', product_id=product_id))
+    return redirect(url_for('products_detail', product_id=product_id), code=303)
 
 @app.route('/products/scan-increment', methods=['GET'])
 def products_scan_increment():
     if not ENABLE_CAMERA:
-        return render_template('redirect.html', target=url_for('products_list'))
+        return redirect(url_for('products_list'), code=303)
     """
     Scanner en stregkode og lægger delta til lageret.
-    Hvis produktet ikke findes, redirecter til 'Nyt produkt' med EAN forudfyldt.
+    Hvis produktet ikke findes, oprettes det med lager = delta (mindst 0), og der
+    redirectes til 'Nyt produkt' med EAN forudfyldt – også ved senere scans,
+    så længe produktet ikke har fået et navn.
     """
     try:
         delta = int(request.args.get('delta', 1))
@@ -395,40 +867,31 @@ def products_scan_increment():
 
     ean = read_barcode_from_camera()
     if not ean:
-        return render_template('redirect.html', target=url_for('products_list'))
+        return redirect(url_for('products_list'), code=303)
 
-    clean = ''.join(ch for ch in str(ean) if ch.isdigit())
+    clean = _digits(str(ean))
     if len(clean) < 12:
-        return render_template('redirect.html', target=url_for('products_list'))
+        return redirect(url_for('products_list'), code=303)
 
-    # Gem 'barcode {EAN}.png' i static/barcodes hvis ikke den findes (simpel helper)
-    try:
-        save_barcode_simple(clean)
-    except Exception:
-        pass
+    # Gem 'barcode {EAN}.png' i static/barcodes hvis ikke den findes (i baggrunden)
+    save_barcode_background(clean)
 
     # DB: find/opdater, ellers send til create med EAN udfyldt
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-        cur.execute("SELECT product_id FROM produkter WHERE product_ean = %s", (clean,))
-        row = cur.fetchone()
-
-        if row:
-            pid = row['product_id']
-            cur.execute(
-                "UPDATE produkter SET stock_qty = stock_qty + %s WHERE product_id = %s",
-                (delta, pid)
-            )
+        with db_conn() as conn, conn.cursor() as cur:
+            # Opret eller læg til i én atomisk query; nye rækker starter aldrig med negativt lager
+            _execute(cur, "stmt_scan_upsert", (clean, delta, delta))
+            pid, needs_details = cur.fetchone()
             conn.commit()
-            cur.close(); conn.close()
-            return render_template('redirect.html', target=url_for('products_detail', product_id=pid))
-        else:
-            cur.close(); conn.close()
-            return render_template('redirect.html', target=url_for('products_create', ean=clean))
+
+            if needs_details:
+                # nyt eller ufærdigt produkt (intet navn endnu): udfyld navn m.m.
+                # (create-UPSERT bevarer det scannede antal)
+                return redirect(url_for('products_create', ean=clean), code=303)
+            else:
+                return redirect(url_for('products_detail', product_id=pid), code=303)
     except Exception:
-        return render_template('redirect.html', target=url_for('products_list'))
+        return redirect(url_for('products_list'), code=303)
 
 
 
@@ -438,22 +901,23 @@ def products_photo_edit(product_id):
     Interaktivt produktfoto for eksisterende produkt. Navngiver efter EAN hvis muligt.
     Opdaterer product_image i DB og returnerer til detaljevisning.
     """
+    if not ENABLE_CAMERA:
+        return redirect(url_for('products_detail', product_id=product_id), code=303)
+
     # Hent EAN
     ean = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("SELECT product_ean FROM produkter WHERE product_id = %s", (product_id,))
-        row = cur.fetchone()
-        cur.close(); conn.close()
-        if row: ean = (row.get('product_ean') or '').strip()
+        with db_conn(autocommit=True) as conn, conn.cursor() as cur:
+            cur.execute("SELECT product_ean FROM produkter WHERE product_id = %s", (product_id,))
+            row = cur.fetchone()
+        if row: ean = (row[0] or '').strip()
     except Exception as e:
         return render_template('product_detail.html',
                                error=f"Databasefejl ved hentning: {e}",
                                product={'product_id': product_id})
 
     base = f"product_{ean}" if ean else f"product_id_{product_id}"
-    img_rel = capture_photo_interactive_to_static(base)
+    img_rel = capture_photo_interactive_to_static(base, hires=request.args.get('hires') == '1')
     if not img_rel:
         return render_template('product_detail.html',
                                error="Foto blev annulleret eller mislykkedes.",
@@ -461,21 +925,18 @@ def products_photo_edit(product_id):
 
     # Gem sti i DB
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            UPDATE produkter
-               SET product_image = %s
-             WHERE product_id   = %s
-        """, (img_rel, product_id))
-        conn.commit()
-        cur.close(); conn.close()
+        with db_conn(autocommit=True) as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE produkter
+                   SET product_image = %s
+                 WHERE product_id   = %s
+            """, (img_rel, product_id))
     except Exception as e:
         return render_template('product_detail.html',
                                error=f"Databasefejl ved opdatering: {e}",
                                product={'product_id': product_id})
 
-    return render_template('redirect.html', target=url_for('products_detail', product_id=product_id))
+    return redirect(url_for('products_detail', product_id=product_id), code=303)
 
 
 @app.route('/products/new/photo')
@@ -485,42 +946,48 @@ def products_photo_new():
     Returnerer redirect til create-form med ?ean=...&img=...
     """
     ean = (request.args.get('ean') or '').strip()
+    if not ENABLE_CAMERA:
+        return redirect(url_for('products_create', ean=ean), code=303)
     if not ean:
         return render_template('product_form.html', mode='create',
                                error="Mangler EAN til foto. Scan eller indtast EAN først.",
                                product=None)
 
-    img_rel = capture_photo_interactive_to_static(f"product_{ean}")
+    img_rel = capture_photo_interactive_to_static(f"product_{ean}", hires=request.args.get('hires') == '1')
     if not img_rel:
         return render_template('product_form.html', mode='create',
                                error="Foto blev annulleret eller mislykkedes.",
                                product={'product_ean': ean, 'product_name': '', 'product_desc': ''})
 
-    return render_template('redirect.html', target=url_for('products_create', ean=ean, img=img_rel))
+    return redirect(url_for('products_create', ean=ean, img=img_rel), code=303)
 
 
 @app.route('/products')
 def products_list():
     """
     Viser alle produkter i en tabel med links til vis/rediger/slet.
+    Rækkerne streames fra en server-side cursor direkte ind i skabelonen,
+    så hele tabellen aldrig ligger i hukommelsen på én gang.
     """
-    rows = []
-    error = None
+    # forbindelse og cursor lukkes først, når svaret er sendt færdigt
+    stack = ExitStack()
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        conn = stack.enter_context(db_conn())
+        cur = stack.enter_context(
+            conn.cursor(name='prodlist', cursor_factory=psycopg2.extras.NamedTupleCursor))
+        cur.itersize = 500
         cur.execute("""
             SELECT product_id, product_ean, product_name, product_desc, stock_qty
             FROM produkter
             ORDER BY product_id ASC
             """)
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
     except Exception as e:
-        error = f"Databasefejl: {e}"
+        stack.close()
+        return render_template('products.html', rows=[], error=f"Databasefejl: {e}")
 
-    return render_template('products.html', rows=rows, error=error)
+    resp = app.response_class(stream_template('products.html', rows=cur, error=None))
+    resp.call_on_close(stack.close)
+    return resp
 
 
 @app.route('/products/new', methods=['GET', 'POST'])
@@ -539,7 +1006,7 @@ def products_create():
     }
 
     if request.method == 'POST':
-        product_ean = ''.join(ch for ch in (request.form.get('product_ean') or '').strip() if ch.isdigit())
+        product_ean = _digits(request.form.get('product_ean') or '')
         product_name = (request.form.get('product_name') or '').strip()
         product_desc = (request.form.get('product_desc') or '').strip()
         product_image = (request.form.get('product_image') or '').strip() or None
@@ -551,22 +1018,20 @@ def products_create():
             error = "EAN og navn skal udfyldes."
         else:
             try:
-                conn = get_db_connection()
-                cur = conn.cursor()
-                cur.execute("""
-                    INSERT INTO produkter (product_ean, product_name, product_desc, product_image, tags)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (product_ean) DO UPDATE
-                    SET product_name  = EXCLUDED.product_name,
-                        product_desc  = EXCLUDED.product_desc,
-                        product_image = COALESCE(EXCLUDED.product_image, produkter.product_image),
-                        tags          = COALESCE(NULLIF(EXCLUDED.tags, '{}'::text[]), produkter.tags)
-                    RETURNING product_id
-                """, (product_ean, product_name, product_desc, product_image, tags_list))
-                new_id = cur.fetchone()[0]
-                conn.commit()
-                cur.close(); conn.close()
-                return render_template('redirect.html', target=url_for('products_detail', product_id=new_id))
+                with db_conn() as conn, conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO produkter (product_ean, product_name, product_desc, product_image, tags)
+                        VALUES (%s, %s, %s, %s, %s)
+                        ON CONFLICT (product_ean) DO UPDATE
+                        SET product_name  = EXCLUDED.product_name,
+                            product_desc  = EXCLUDED.product_desc,
+                            product_image = COALESCE(EXCLUDED.product_image, produkter.product_image),
+                            tags          = COALESCE(NULLIF(EXCLUDED.tags, '{}'::text[]), produkter.tags)
+                        RETURNING product_id
+                    """, (product_ean, product_name, product_desc, product_image, tags_list))
+                    new_id = cur.fetchone()[0]
+                    conn.commit()
+                return redirect(url_for('products_detail', product_id=new_id), code=303)
             except Exception as e:
                 error = f"Databasefejl: {e}"
 
@@ -586,54 +1051,40 @@ def products_create():
 @app.route('/products/new/scan', methods=['GET'])
 def products_scan():
     if not ENABLE_CAMERA:
-        return render_template('redirect.html', target=url_for('products_list'))    
+        return redirect(url_for('products_list'), code=303)
     ean = read_barcode_from_camera()
     if not ean:
         return render_template('product_form.html', mode='create',
                                error="Ingen stregkode fundet.", product=None)
 
-    clean = ''.join(ch for ch in str(ean) if ch.isdigit())
+    clean = _digits(str(ean))
     if len(clean) < 12:
         return render_template('product_form.html', mode='create',
                                error="Ugyldig EAN (for kort).", product={'product_ean': clean})
 
-    # Gem 'barcode {EAN}.png' i static/barcodes hvis ikke den findes
-    save_barcode_simple(clean)
+    # Gem 'barcode {EAN}.png' i static/barcodes hvis ikke den findes (i baggrunden)
+    save_barcode_background(clean)
 
     # Forudfyld create-formularen med EAN
-    return render_template('redirect.html', target=url_for('products_create', ean=clean))
+    return redirect(url_for('products_create', ean=clean), code=303)
 
 
 
 @app.route('/products/<int:product_id>')
-def products_detail(product_id):
-    product = None
+@with_db
+def products_detail(conn, product_id):
     image_url = None
-    error = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("""
-            SELECT product_id, product_ean, product_name, product_desc, product_image, stock_qty, tags
-            FROM produkter
-            WHERE product_id = %s
-            """, (product_id,))
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        _execute(cur, "stmt_detail", (product_id,))
         product = cur.fetchone()
-        cur.close()
-        conn.close()
-
-        # Stregkode (som før)
-        if product and product.get('product_ean'):
-            barcode_dir = os.path.join(app.static_folder, 'barcodes')
-            fname = f"barcode {product['product_ean']}.png"  # eller .svg hvis du bruger svg
-            fpath = os.path.join(barcode_dir, fname)
-            if os.path.exists(fpath):
-                image_url = url_for('static', filename=f'barcodes/{fname}')
 
-    except Exception as e:
-        error = f"Databasefejl: {e}"
+    # Stregkode (som før)
+    if product and product.get('product_ean'):
+        fname = f"barcode {product['product_ean']}.png"  # eller .svg hvis du bruger svg
+        if _barcode_exists(fname):
+            image_url = url_for('barcode', fname=fname)
 
-    return render_template('product_detail.html', product=product, image_url=image_url, error=error)
+    return render_template('product_detail.html', product=product, image_url=image_url, error=None)
 
 
 
@@ -647,17 +1098,10 @@ def products_edit(product_id):
 
     # hent eksisterende
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("""
-                SELECT product_id, product_ean, product_name, product_desc, product_image, stock_qty, tags
-                FROM produkter
-                WHERE product_id = %s
-                """, (product_id,))
+        with db_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            _execute(cur, "stmt_detail", (product_id,))
 
-        product = cur.fetchone()
-        cur.close()
-        conn.close()
+            product = cur.fetchone()
     except Exception as e:
         error = f"Databasefejl: {e}"
 
@@ -679,19 +1123,17 @@ def products_edit(product_id):
             tags_param = tags_list  # evt. []
 
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("""
-            UPDATE produkter
-               SET product_ean  = %s,
-                   product_name = %s,
-                   product_desc = %s,
-                   tags         = %s
-             WHERE product_id  = %s
-            """, (product_ean, product_name, product_desc, tags_param, product_id))
-            conn.commit()
-            cur.close(); conn.close()
-            return render_template('redirect.html', target=url_for('products_detail', product_id=product_id))
+            with db_conn() as conn, conn.cursor() as cur:
+                cur.execute("""
+                UPDATE produkter
+                   SET product_ean  = %s,
+                       product_name = %s,
+                       product_desc = %s,
+                       tags         = %s
+                 WHERE product_id  = %s
+                """, (product_ean, product_name, product_desc, tags_param, product_id))
+                conn.commit()
+            return redirect(url_for('products_detail', product_id=product_id), code=303)
         except Exception as e:
             error = f"Databasefejl: {e}"
 
@@ -701,25 +1143,17 @@ def products_edit(product_id):
 
 
 @app.route('/products/<int:product_id>/delete', methods=['POST'])
-def products_delete(product_id):
+@with_db(autocommit=True)
+def products_delete(conn, product_id):
     """
     Slet produkt (POST for at undgå utilsigtet sletning).
+    Ved fejl viser with_db detail-siden med fejlen.
     """
-    error = None
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+    with conn.cursor() as cur:
         cur.execute("DELETE FROM produkter WHERE product_id = %s", (product_id,))
-        conn.commit()
-        cur.close()
-        conn.close()
-    except Exception as e:
-        error = f"Databasefejl: {e}"
-        # vis detail-side med fejl
-        return render_template('product_detail.html', product={'product_id': product_id}, error=error)
 
     # tilbage til liste
-    return render_template('redirect.html', target=url_for('products_list'))
+    return redirect(url_for('products_list'), code=303)
 
 
 # --------------- Run the App ---------------